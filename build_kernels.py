@@ -0,0 +1,21 @@
+"""kernels.py の数値カーネルを numba.pycc で事前 (AOT) コンパイルする
+
+    python build_kernels.py
+
+を実行すると、このディレクトリに toushi_kernels の拡張モジュール (.so / .pyd) が生成される。
+toushi.py はそれを優先して読み込むため、Streamlit起動直後の初回リクエストでもJITコンパイルの待ち時間が発生しない。
+デプロイ先と同じOS・Python・NumPyのバージョンでビルドすること。
+"""
+import os
+from numba.pycc import CC
+import kernels
+
+cc = CC('toushi_kernels')
+cc.output_dir = os.path.dirname(os.path.abspath(__file__))
+cc.export('indicators_loop', 'UniTuple(f4[:], 7)(f4[:], f4[:], f4[:])')(kernels.indicators_loop.py_func)
+cc.export('macd_fused', 'UniTuple(f4[:], 2)(f4[:], f8, f8, f8)')(kernels.macd_fused.py_func)
+cc.export('score_signals', 'UniTuple(i8[:], 2)(f4[:], f4[:], f4[:], f4[:], f4[:], f4[:], f4[:], f4[:], f4[:], i8, b1)')(kernels.score_signals.py_func)
+cc.export('lttb', 'i8[:](f8[:], i8)')(kernels.lttb.py_func)
+
+if __name__ == '__main__':
+    cc.compile()
@@ -0,0 +1,233 @@
+"""toushi.py で使う指標計算・描画用の数値カーネル (Numba)
+
+build_kernels.py でこれらを事前コンパイルした toushi_kernels モジュールを生成でき、
+toushi.py はそれがあれば優先して読み込む (無ければここのJIT版を使う)。
+"""
+import numpy as np
+try:
+    from numba import njit
+except ImportError: # numbaが無い環境では同じコードを純Pythonのまま実行する (低速だが結果は同じ)
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda func: func
+
+# シグナルのビット (toushi.py の表示用テキスト表と score_signals で共有する)
+SIG_LONG_UP, SIG_BB_LOWER, SIG_RSI_DIP, SIG_GOLDEN_CROSS, SIG_GC_VOLUME = 1 << 0, 1 << 1, 1 << 2, 1 << 3, 1 << 4
+SIG_LONG_NOT_UP, SIG_BB_UPPER, SIG_RSI_HIGH, SIG_DEAD_CROSS, SIG_SMA200_BREAK = 1 << 5, 1 << 6, 1 << 7, 1 << 8, 1 << 9
+SIG_BB_LOWER_TOUCH = 1 << 10 # Bバンド-2σタッチそのもの (トレンドに関係なく立つ。発生回数の集計用)
+BUY_SCORE_MASK = SIG_BB_LOWER | SIG_RSI_DIP | SIG_GOLDEN_CROSS | SIG_GC_VOLUME # 1つ点灯するごとに評価+1
+
+@njit(cache=True)
+def _nan_like(arr):
+    """arrと同じ長さ・dtypeのNaN配列"""
+    out = np.empty_like(arr)
+    out[:] = np.nan
+    return out
+
+@njit(cache=True)
+def _delta(close, i):
+    """前日比 (先頭行・欠損はpandasのdiff+whereと同じく0扱い)"""
+    if i < 1:
+        return 0.0
+    d = close[i] - close[i - 1]
+    return 0.0 if np.isnan(d) else d
+
+@njit(cache=True)
+def indicators_loop(close, high, volume):
+    """日足の移動平均・ボリンジャーバンド用標準偏差・出来高平均・60日高値・RSIを一回の走査で計算する
+
+    各窓は入ってくる値を足して抜ける値を引く累積和で更新し、60日高値は単調減少の両端キューで求める。
+    窓内に欠損を含む位置はNaN (pandasのrollingと同じ)。
+    入出力は入力と同じdtype (float32可) で、累積和などの内部状態はfloat64で保持する。
+    二乗和は値をfloat64に広げてから二乗する (低ボラティリティの銘柄では、float32で二乗した丸め誤差が
+    q20 - s20^2/20 の差し引きで桁落ちして標準偏差が大きく狂うため)。
+    戻り値: (sma200, sma50, sma20, std20, volume_ma20, high_60d, rsi)
+    """
+    n = close.size
+    sma200, sma50, sma20, std20 = _nan_like(close), _nan_like(close), _nan_like(close), _nan_like(close)
+    volume_ma20, high_60d = _nan_like(volume), _nan_like(high)
+    rsi = _nan_like(close)
+    s200 = s50 = s20 = q20 = sv20 = avg_g = avg_l = 0.0
+    nan200 = nan50 = nan20 = nanv20 = nanh60 = 0
+    dq = np.empty(n, dtype=np.int64) # 60日高値の候補 (高値が単調減少するインデックス列)
+    head = tail = 0
+    for i in range(n):
+        # 終値の窓 (200/50/20日)
+        c = np.float64(close[i]) # 二乗の前にfloat64へ広げる (float32のまま二乗すると丸め誤差が分散の差し引きで増幅される)
+        if np.isnan(c):
+            nan200 += 1
+            nan50 += 1
+            nan20 += 1
+        else:
+            s200 += c
+            s50 += c
+            s20 += c
+            q20 += c * c
+        if i >= 200:
+            o = close[i - 200]
+            if np.isnan(o): nan200 -= 1
+            else: s200 -= o
+        if i >= 50:
+            o = close[i - 50]
+            if np.isnan(o): nan50 -= 1
+            else: s50 -= o
+        if i >= 20:
+            o = np.float64(close[i - 20])
+            if np.isnan(o):
+                nan20 -= 1
+            else:
+                s20 -= o
+                q20 -= o * o
+        if i >= 199 and nan200 == 0: sma200[i] = s200 / 200
+        if i >= 49 and nan50 == 0: sma50[i] = s50 / 50
+        if i >= 19 and nan20 == 0:
+            sma20[i] = s20 / 20
+            var = (q20 - s20 * s20 / 20) / 19 # 不偏分散 (ddof=1)
+            std20[i] = np.sqrt(var) if var > 0.0 else 0.0
+
+        # 出来高の20日平均
+        v = volume[i]
+        if np.isnan(v): nanv20 += 1
+        else: sv20 += v
+        if i >= 20:
+            o = volume[i - 20]
+            if np.isnan(o): nanv20 -= 1
+            else: sv20 -= o
+        if i >= 19 and nanv20 == 0: volume_ma20[i] = sv20 / 20
+
+        # 60日高値 (両端キュー: 新しい高値以下の候補を末尾から捨て、窓外に出た先頭を捨てる)
+        h = high[i]
+        if np.isnan(h):
+            nanh60 += 1
+        else:
+            while tail > head and high[dq[tail - 1]] <= h:
+                tail -= 1
+            dq[tail] = i
+            tail += 1
+        if i >= 60 and np.isnan(high[i - 60]): nanh60 -= 1
+        while tail > head and dq[head] <= i - 60:
+            head += 1
+        if i >= 59 and nanh60 == 0: high_60d[i] = high[dq[head]]
+
+        # RSI (Wilderの平滑化: 最初の14日分は単純平均、以降は (前回値×13 + 当日値) / 14)
+        if i >= 1:
+            d = _delta(close, i)
+            g, l = max(d, 0.0), max(-d, 0.0)
+            if i <= 14:
+                avg_g += g / 14
+                avg_l += l / 14
+            else:
+                avg_g = (avg_g * 13 + g) / 14
+                avg_l = (avg_l * 13 + l) / 14
+            if i >= 14:
+                # 下落幅ゼロなら100、値動き自体が無い場合は従来通り0とする
+                rsi[i] = 100 - 100 / (1 + avg_g / avg_l) if avg_l > 0 else (100.0 if avg_g > 0 else 0.0)
+    return sma200, sma50, sma20, std20, volume_ma20, high_60d, rsi
+
+@njit(cache=True)
+def macd_fused(x, a_fast, a_slow, a_signal):
+    """MACDとシグナル線を一回の走査で計算する (欠損の無い入力ではpandasのewm(adjust=False)を3本連ねたのと同じ結果)
+
+    短期・長期EMAとシグナル線の3つの漸化式をまとめて更新する。欠損値では短期・長期EMAが直前の値を引き継ぐ
+    (pandasのように欠損の後の値の重みを (1-α)^k で補正はしないので、欠損を含む場合は結果が異なる)。
+    先頭の欠損区間はNaNのまま。出力はxと同じdtype、状態はfloat64で保持する。
+    戻り値: (macd, signal)
+    """
+    n = x.size
+    macd, signal = np.empty_like(x), np.empty_like(x)
+    fast = slow = sig = np.nan
+    for i in range(n):
+        v = x[i]
+        if not np.isnan(v):
+            if np.isnan(fast):
+                fast = slow = v
+            else:
+                fast += a_fast * (v - fast)
+                slow += a_slow * (v - slow)
+        m = fast - slow
+        if not np.isnan(m): # シグナル線は欠損日も引き継いだMACDで更新する
+            sig = m if np.isnan(sig) else sig + a_signal * (m - sig)
+        macd[i] = m
+        signal[i] = sig
+    return macd, signal
+
+@njit(cache=True)
+def score_signals(close, sma200, bb_upper, bb_lower, rsi, macd, macd_signal, volume, volume_ma20, start, long_up):
+    """start行目以降の各日について、点灯しているシグナルのビットマスクと買いスコアを一回の走査で求める
+
+    シグナルの判定条件はここだけに書く (toushi.py は最新日も直近N日の回数もこの結果から読む)。
+    クロス・下抜けは前日との比較で、先頭行は前日が無いので点灯しない。NaNとの比較は偽。
+    押し目系の買いシグナルは長期トレンドが良好な (long_up) 場合のみ。start=0 なら全期間を判定できる。
+    戻り値: (masks, scores) 長さ n - start のint64配列
+    """
+    n = close.size
+    start = max(start, 0)
+    masks = np.zeros(max(n - start, 0), dtype=np.int64)
+    scores = np.zeros(max(n - start, 0), dtype=np.int64)
+    for i in range(start, n):
+        c = close[i]
+        has_prev = i >= 1
+        golden_cross = has_prev and macd[i - 1] < macd_signal[i - 1] and macd[i] > macd_signal[i]
+        mask = SIG_LONG_UP if long_up else SIG_LONG_NOT_UP
+        if c <= bb_lower[i]:
+            mask |= SIG_BB_LOWER_TOUCH
+            if long_up:
+                mask |= SIG_BB_LOWER
+        if long_up and 30 <= rsi[i] <= 45:
+            mask |= SIG_RSI_DIP
+        if golden_cross:
+            mask |= SIG_GOLDEN_CROSS
+            if volume[i] > volume_ma20[i] * 1.5:
+                mask |= SIG_GC_VOLUME
+        # 売り・注意シグナル
+        if c >= bb_upper[i]:
+            mask |= SIG_BB_UPPER
+        if rsi[i] >= 70:
+            mask |= SIG_RSI_HIGH
+        if has_prev and macd[i - 1] > macd_signal[i - 1] and macd[i] < macd_signal[i]:
+            mask |= SIG_DEAD_CROSS
+        if has_prev and close[i - 1] > sma200[i - 1] and c < sma200[i]:
+            mask |= SIG_SMA200_BREAK
+        score = 0
+        bits = mask & BUY_SCORE_MASK
+        while bits:
+            score += bits & 1
+            bits >>= 1
+        masks[i - start] = mask
+        scores[i - start] = score
+    return masks, scores
+
+@njit(cache=True)
+def lttb(y, n_out):
+    """Largest-Triangle-Three-Buckets法で、形を保ったまま間引く点の位置を返す"""
+    n = y.size
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    idx = np.empty(n_out, dtype=np.int64)
+    idx[0] = 0
+    every = (n - 2) / (n_out - 2)
+    a = 0
+    for i in range(n_out - 2):
+        # 次のバケットの平均点
+        s = int((i + 1) * every) + 1
+        e = min(int((i + 2) * every) + 1, n)
+        avg_x = 0.0
+        avg_y = 0.0
+        for j in range(s, e):
+            avg_x += j
+            avg_y += y[j]
+        avg_x /= e - s
+        avg_y /= e - s
+        # 現在のバケットから三角形の面積が最大の点を選ぶ
+        best = int(i * every) + 1
+        max_area = -1.0
+        for j in range(best, int((i + 1) * every) + 1):
+            area = abs((a - avg_x) * (y[j] - y[a]) - (a - j) * (avg_y - y[a]))
+            if area > max_area:
+                max_area = area
+                best = j
+        idx[i + 1] = best
+        a = best
+    idx[n_out - 1] = n - 1
+    return idx
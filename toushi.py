@@ -1,109 +1,272 @@
 import streamlit as st
-import yfinance as yf
+import numpy as np
 import pandas as pd
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
+import os
+import re
+import tempfile
+import time
+from enum import IntEnum
 from datetime import datetime, timedelta
+try:
+    # build_kernels.py で事前コンパイル済みならJITコンパイルの待ち時間なしで使う
+    from toushi_kernels import indicators_loop, lttb, macd_fused, score_signals
+except ImportError:
+    from kernels import indicators_loop, lttb, macd_fused, score_signals
+from kernels import SIG_LONG_UP, SIG_BB_LOWER, SIG_RSI_DIP, SIG_GOLDEN_CROSS, SIG_GC_VOLUME, SIG_LONG_NOT_UP, SIG_BB_UPPER, SIG_RSI_HIGH, SIG_DEAD_CROSS, SIG_SMA200_BREAK, SIG_BB_LOWER_TOUCH
 
-# --- 1. テクニカル指標を計算する関数 ---
+# --- 1. データ取得とテクニカル指標を計算する関数 ---
+CACHE_TTL = 3600 # 株価データ・計算結果のキャッシュ有効期間 (秒)
+
+OHLCV_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume']
+PRICE_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache') # 銘柄ごとの株価をparquetで保存する場所
+
+def _price_cache_path(ticker_symbol):
+    """銘柄の株価キャッシュファイルのパス (ファイル名に使えない文字と先頭の . は _ に置き換える)"""
+    return os.path.join(PRICE_CACHE_DIR, re.sub(r'[^\w.^=-]|^\.', '_', ticker_symbol), 'prices.parquet')
+
+def _read_price_cache(path):
+    """保存済みのキャッシュと、それが有効期間内かどうかを返す (無い・読めない・形式が違う場合は (None, False))"""
+    try:
+        data = pd.read_parquet(path)
+        saved_at = os.path.getmtime(path)
+    except Exception: # ファイルが無い・壊れている・parquetを扱えないなどはキャッシュ無しとして扱う
+        return None, False
+    # 旧形式 (2段の列など) や列・型の違うファイルは使わず、取り直して上書きする
+    if not data.columns.equals(pd.Index(OHLCV_COLUMNS)) or not (data.dtypes == np.float32).all():
+        return None, False
+    return data, time.time() - saved_at <= CACHE_TTL
+
+def _write_price_cache(path, data):
+    """キャッシュを保存する (書き込み途中のファイルを読まないよう一時ファイルから置き換える。失敗しても無視)"""
+    tmp_path = None
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Streamlitは各セッションを同じプロセスのスレッドで動かすため、一時ファイル名は書き込みごとに一意にする
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), suffix='.tmp', delete=False) as tmp:
+            tmp_path = tmp.name
+        data.to_parquet(tmp_path)
+        os.replace(tmp_path, path)
+    except Exception:
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def _download_ohlcv(ticker_symbol, **period):
+    """yfinanceからダウンロードし、1段の列のOHLCVだけにして返す (periodはyf.downloadのperiod/startをそのまま渡す)"""
+    # 配当・分割の列と進捗表示は不要、1銘柄なのでスレッドも使わない。
+    # 株式分割で価格が不連続にならないよう、調整済み価格 (auto_adjust=True) は明示的に維持する
+    import yfinance as yf # 起動直後の画面表示を速くするため、使う時に読み込む
+    data = yf.download(ticker_symbol, auto_adjust=True, actions=False, progress=False, threads=False, **period)
+    if data.empty:
+        return data
+    # yfinanceは (項目, ティッカー) の2段の列を返すことがあるので1段にし、使わない列はキャッシュする前に落とす
+    if isinstance(data.columns, pd.MultiIndex):
+        data = data.set_axis(data.columns.get_level_values(0), axis=1)
+    return data[OHLCV_COLUMNS]
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False)
+def get_stock_data(ticker_symbol):
+    """yfinanceから全期間のOHLCVを取得する (1時間キャッシュし再実行時の通信を省く)
+
+    取得結果はディスクにも保存し、Streamlitの再起動後も有効期間内ならダウンロードせずに読み込む。
+    期限切れのキャッシュがあれば、全期間ではなくその続きの数日分だけをダウンロードして継ぎ足す。
+    """
+    path = _price_cache_path(ticker_symbol)
+    cached, fresh = _read_price_cache(path)
+    if fresh:
+        return cached
+    data = None
+    if cached is not None and len(cached) >= 2:
+        # 最終行は保存時点で取引中だった可能性があるので、最後から2本目 (確定済み) の日から取り直して継ぎ足す。
+        # その日の終値が変わっていれば配当・分割で過去の調整済み価格ごと変わっているので、全期間を取り直す
+        overlap = cached.index[-2]
+        new = _download_ohlcv(ticker_symbol, start=overlap.strftime('%Y-%m-%d'))
+        if new.columns.equals(cached.columns) and overlap in new.index and np.allclose(new['Close'].loc[[overlap]].to_numpy(), cached['Close'].loc[[overlap]].to_numpy(), rtol=1e-6, equal_nan=True):
+            data = pd.concat([cached.loc[:overlap].iloc[:-1], new])
+            data = data[~data.index.duplicated(keep='last')]
+    if data is None:
+        data = _download_ohlcv(ticker_symbol, period="max")
+        # 通信障害などで取得できなかった場合は、空のデータ (銘柄なし扱い) より期限切れのキャッシュを返す
+        if data.empty and cached is not None:
+            return cached
+    # 指標計算・チャートには単精度で十分なため、取得直後にfloat32にしてメモリ・キャッシュのサイズを半分にする
+    data = data.astype(np.float32)
+    if not data.empty:
+        _write_price_cache(path, data)
+    return data
+
+MACD_ALPHAS = (2 / 13, 2 / 27, 2 / 10) # MACDの短期・長期EMAとシグナル線の平滑化係数 (span=12, 26, 9)
+WEEKLY_MACD_WEEKS = 104 # 週足MACDの計算に使う週数 (26週EMAの初期値の影響が0.1%未満になる長さ)
+
+def _frame_key(df):
+    """キャッシュ用のDataFrameのキー (全データをハッシュせず、形状・期間の両端・最終行の値で同一性を判定)"""
+    if df.empty:
+        return (df.shape,)
+    return (df.shape, df.index[0].value, df.index[-1].value, df.iloc[-1].to_numpy(dtype=np.float64).tobytes())
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False, hash_funcs={pd.DataFrame: _frame_key})
 def calculate_indicators(df):
-    """データフレームにテクニカル指標を追加する"""
-    df['SMA200'] = df['Close'].rolling(window=200).mean()
-    df['SMA50'] = df['Close'].rolling(window=50).mean()
-    df['SMA20'] = df['Close'].rolling(window=20).mean()
-    rolling_std = df['Close'].rolling(window=20).std()
-    df['BB_UPPER'] = df['SMA20'] + (rolling_std * 2)
-    df['BB_LOWER'] = df['SMA20'] - (rolling_std * 2)
-    delta = df['Close'].diff()
-    gain = (delta.where(delta > 0, 0)).rolling(window=14).mean()
-    loss = (-delta.where(delta < 0, 0)).rolling(window=14).mean()
-    rs = gain / loss
-    rs = rs.fillna(0)
-    df['RSI'] = 100 - (100 / (1 + rs))
-    exp1 = df['Close'].ewm(span=12, adjust=False).mean()
-    exp2 = df['Close'].ewm(span=26, adjust=False).mean()
-    df['MACD'] = exp1 - exp2
-    df['MACD_SIGNAL'] = df['MACD'].ewm(span=9, adjust=False).mean()
-    df['Volume_MA20'] = df['Volume'].rolling(window=20).mean()
-    df['High_60d'] = df['High'].rolling(window=60).max()
-    
-    df_weekly = df.resample('W-FRI').agg({'Open': 'first', 'High': 'max', 'Low': 'min', 'Close': 'last', 'Volume': 'sum'}).dropna()
-    exp1_w = df_weekly['Close'].ewm(span=12, adjust=False).mean()
-    exp2_w = df_weekly['Close'].ewm(span=26, adjust=False).mean()
-    df_weekly['MACD_W'] = exp1_w - exp2_w
-    
-    return df.dropna(subset=['SMA200']), df_weekly.dropna()
+    """OHLCVのデータフレームにテクニカル指標の列を加えた新しいデータフレームを返す (引数は変更しない)"""
+    # get_stock_dataでfloat32にしてあるのでそのまま取り出せる (カーネル内部の累積和はfloat64で保持するので誤差は溜まらない)
+    open_, high, low, close, volume = (df[c].to_numpy(dtype=np.float32) for c in ('Open', 'High', 'Low', 'Close', 'Volume'))
+    # 移動平均・標準偏差・出来高平均・60日高値・RSIは一回の走査でまとめて計算する
+    sma200, sma50, sma20, std20, volume_ma20, high_60d, rsi = indicators_loop(close, high, volume)
+    macd, macd_signal = macd_fused(close, *MACD_ALPHAS)
+
+    # 週足MACDは最新値しか使わないため、EMAが十分収束する直近分の終値だけを週足 (金曜締め) にする。
+    # resampleの代わりに日付から週番号を求め、週番号が変わる直前の (欠損でない) 終値を各週の終値とする。
+    # 1970-01-01は木曜なので、エポックからの日数から2を引いて7で割った商が土曜〜金曜の週ごとに1つずつ増える
+    start = df.index.searchsorted(df.index[-1] - pd.Timedelta(weeks=WEEKLY_MACD_WEEKS))
+    dates = df.index[start:] if df.index.tz is None else df.index[start:].tz_localize(None) # 現地の日付で区切る
+    valid = ~np.isnan(close[start:])
+    recent_close = close[start:][valid]
+    week = (dates.to_numpy(dtype='datetime64[D]').astype(np.int64)[valid] - 2) // 7
+    close_w = recent_close[np.append(week[1:] != week[:-1], True)] if week.size else recent_close
+    macd_w, _ = macd_fused(close_w, *MACD_ALPHAS)
+    macd_w_last = float(macd_w[-1]) if macd_w.size else np.nan
+
+    # 列ごとに代入を繰り返さず、最も長いウォームアップ (SMA200の199行) を除いた範囲で一度に組み立てる
+    warmup = slice(200 - 1, None)
+    columns = {'Open': open_, 'High': high, 'Low': low, 'Close': close, 'Volume': volume, 'SMA200': sma200, 'SMA50': sma50, 'SMA20': sma20,
+               'BB_UPPER': sma20 + (std20 * 2), 'BB_LOWER': sma20 - (std20 * 2), 'RSI': rsi, 'MACD': macd, 'MACD_SIGNAL': macd_signal,
+               'Volume_MA20': volume_ma20, 'High_60d': high_60d}
+    return pd.DataFrame({name: values[warmup] for name, values in columns.items()}, index=df.index[warmup]), macd_w_last
 
 # --- 2. 分析ロジック関数 ---
-def analyze_signals(df, df_weekly):
+RECENT_SIGNAL_DAYS = 20 # 直近のシグナル発生回数を数える営業日数
+
+class Trend(IntEnum):
+    """トレンドの方向 (判定は整数で行い、表示用の文字列は最後に表から引く)"""
+    DOWN = -1
+    FLAT = 0
+    UP = 1
+
+LONG_TREND_LABELS = {Trend.UP: "🟢 上昇基調", Trend.FLAT: "🟡 中立/方向性不定", Trend.DOWN: "🔴 下降基調"}
+MID_TREND_LABELS = {Trend.UP: "🟢 上昇", Trend.FLAT: "🟡 もみ合い", Trend.DOWN: "🔴 下降"}
+SHORT_TREND_LABELS = {Trend.UP: "🟢 上昇", Trend.FLAT: "🟡 もみ合い", Trend.DOWN: "🔴 調整/下降"}
+
+RECENT_SIGNAL_LABELS = ((SIG_GOLDEN_CROSS, "MACDゴールデンクロス"), (SIG_DEAD_CROSS, "MACDデッドクロス"), (SIG_BB_LOWER_TOUCH, "Bバンド-2σタッチ"), (SIG_BB_UPPER, "Bバンド+2σ到達")) # 直近N日の発生回数を表示するシグナル
+STAR_TABLE = tuple("★" * i + "☆" * (4 - i) for i in range(5)) # 買いスコア0〜4の星表示
+
+# シグナルはビットマスク (ビットは kernels.py で定義) で保持し、表示用の文章は最後にまとめて生成する
+BUY_SIGNAL_TEXT = (
+    (SIG_LONG_UP, "✅ 長期トレンドが良好です。"),
+    (SIG_BB_LOWER, "✅ Bバンド-2σにタッチ (売られすぎ)"),
+    (SIG_RSI_DIP, "✅ RSIが{rsi:.1f}まで低下 (押し目)"),
+    (SIG_GOLDEN_CROSS, "✅ MACDがゴールデンクロス (買いサイン)"),
+    (SIG_GC_VOLUME, "🔥 出来高急増を伴うクロス (信頼性UP)"),
+)
+SELL_SIGNAL_TEXT = (
+    (SIG_LONG_NOT_UP, "❌ 長期トレンドが下降・中立のため、買いは推奨されません。"),
+    (SIG_BB_UPPER, "⚠️ Bバンド+2σに到達 (過熱感)"),
+    (SIG_RSI_HIGH, "⚠️ RSIが{rsi:.1f} (買われすぎ)"),
+    (SIG_DEAD_CROSS, "❌ MACDがデッドクロス (売りサイン)"),
+    (SIG_SMA200_BREAK, "🚨【損切り警告】200日線を下抜け。長期トレンド転換の可能性。"),
+)
+
+def _trend(close, base, rising):
+    """終値が基準線より上かつ基準が上向きなら上昇、基準線より下なら下降、それ以外 (NaNを含む) は中立"""
+    return Trend.UP if close > base and rising else Trend.DOWN if close < base else Trend.FLAT
+
+@st.cache_data(ttl=CACHE_TTL, show_spinner=False, hash_funcs={pd.DataFrame: _frame_key})
+def analyze_signals(df, macd_w_last):
     """最新のデータに基づいて売買シグナル、トレンド、戦略を分析する"""
-    if len(df) < 2 or len(df_weekly) < 1:
+    if len(df) < 2 or np.isnan(macd_w_last):
         return None # データが不足している場合は分析不能
 
-    latest = df.iloc[-1]
-    previous = df.iloc[-2]
-    latest_weekly = df_weekly.iloc[-1]
+    # 行のSeriesを作らず、必要な列をndarrayとして一度だけ取り出して位置で参照する
+    arr = {c: df[c].to_numpy(copy=False) for c in ('Close', 'SMA200', 'SMA50', 'SMA20', 'BB_UPPER', 'BB_LOWER', 'RSI', 'High_60d', 'MACD', 'MACD_SIGNAL', 'Volume', 'Volume_MA20')}
 
-    signals = {'buy': [], 'sell': [], 'neutral': []}
-    trends = {}
     advice = {'buy_targets': [], 'sell_targets': []}
-    score = 0
+
+    # 最新値は一度だけPythonのfloatにしておき、以降の比較・書式化はローカル変数で行う
+    close, sma200, sma50, sma20, bb_upper, bb_lower, rsi, high_60d = (float(arr[c][-1]) for c in ('Close', 'SMA200', 'SMA50', 'SMA20', 'BB_UPPER', 'BB_LOWER', 'RSI', 'High_60d'))
 
     # トレンド分析
-    trends['long'] = "🟢 上昇基調" if latest['Close'] > latest['SMA200'] and latest_weekly['MACD_W'] > 0 else "🔴 下降基調" if latest['Close'] < latest['SMA200'] else "🟡 中立/方向性不定"
-    trends['mid'] = "🟢 上昇" if latest['Close'] > latest['SMA50'] and latest['SMA50'] > df.iloc[-10]['SMA50'] else "🔴 下降" if latest['Close'] < latest['SMA50'] else "🟡 もみ合い"
-    trends['short'] = "🟢 上昇" if latest['Close'] > latest['SMA20'] and latest['SMA20'] > df.iloc[-5]['SMA20'] else "🔴 調整/下降" if latest['Close'] < latest['SMA20'] else "🟡 もみ合い"
-
-    # シグナル分析
-    if trends['long'] == "🟢 上昇基調":
-        signals['buy'].append("✅ 長期トレンドが良好です。")
-        if latest['Close'] <= latest['BB_LOWER']: signals['buy'].append("✅ Bバンド-2σにタッチ (売られすぎ)"); score += 1
-        if 30 <= latest['RSI'] <= 45: signals['buy'].append(f"✅ RSIが{latest['RSI']:.1f}まで低下 (押し目)"); score += 1
-    else:
-        signals['sell'].append("❌ 長期トレンドが下降・中立のため、買いは推奨されません。")
-
-    if previous['MACD'] < previous['MACD_SIGNAL'] and latest['MACD'] > latest['MACD_SIGNAL']:
-        signals['buy'].append("✅ MACDがゴールデンクロス (買いサイン)"); score += 1
-        if latest['Volume'] > latest['Volume_MA20'] * 1.5: signals['buy'].append("🔥 出来高急増を伴うクロス (信頼性UP)"); score += 1
-
-    # 売り・注意シグナル
-    if latest['Close'] >= latest['BB_UPPER']: signals['sell'].append(f"⚠️ Bバンド+2σに到達 (過熱感)")
-    if latest['RSI'] >= 70: signals['sell'].append(f"⚠️ RSIが{latest['RSI']:.1f} (買われすぎ)")
-    if previous['MACD'] > previous['MACD_SIGNAL'] and latest['MACD'] < latest['MACD_SIGNAL']: signals['sell'].append("❌ MACDがデッドクロス (売りサイン)")
-    if previous['Close'] > previous['SMA200'] and latest['Close'] < latest['SMA200']: signals['sell'].append("🚨【損切り警告】200日線を下抜け。長期トレンド転換の可能性。")
+    long_trend = _trend(close, sma200, macd_w_last > 0)
+    mid_trend = _trend(close, sma50, sma50 > arr['SMA50'][-10])
+    short_trend = _trend(close, sma20, sma20 > arr['SMA20'][-5])
+    long_up = long_trend == Trend.UP
+
+    # シグナル分析 (直近N日の各日のビットマスクと買いスコアをカーネルで一度に求め、最新日の分を使う)
+    masks, scores = score_signals(arr['Close'], arr['SMA200'], arr['BB_UPPER'], arr['BB_LOWER'], arr['RSI'], arr['MACD'], arr['MACD_SIGNAL'],
+                                  arr['Volume'], arr['Volume_MA20'], len(df) - RECENT_SIGNAL_DAYS, long_up)
+    signals_mask, score = int(masks[-1]), int(scores[-1])
+
+    signals = {'buy': [text.format(rsi=rsi) for bit, text in BUY_SIGNAL_TEXT if signals_mask & bit],
+               'sell': [text.format(rsi=rsi) for bit, text in SELL_SIGNAL_TEXT if signals_mask & bit],
+               'neutral': []}
 
     # 戦略アドバイス
-    if trends['long'] == "🟢 上昇基調":
-        advice['buy_targets'] = [f"Bバンド -2σ: **{latest['BB_LOWER']:.2f}円**", f"20日移動平均線: **{latest['SMA20']:.2f}円**", f"50日移動平均線: **{latest['SMA50']:.2f}円**"]
+    if long_up:
+        advice['buy_targets'] = [f"Bバンド -2σ: **{bb_lower:.2f}円**", f"20日移動平均線: **{sma20:.2f}円**", f"50日移動平均線: **{sma50:.2f}円**"]
     else: advice['buy_targets'].append("長期トレンドが下降基調のため、押し目買いは推奨されません。")
-    advice['sell_targets'] = [f"Bバンド +2σ: **{latest['BB_UPPER']:.2f}円**", f"直近60日高値: **{latest['High_60d']:.2f}円**"]
+    advice['sell_targets'] = [f"Bバンド +2σ: **{bb_upper:.2f}円**", f"直近60日高値: **{high_60d:.2f}円**"]
 
     # 総合評価
-    final_score = min(score, 4) if trends['long'] == "🟢 上昇基調" else 0
-    star_rating = "★" * final_score + "☆" * (4 - final_score)
-    comment = "複数の買いシグナルが点灯しており、絶好の買い場が近い可能性があります。" if final_score >= 3 else "長期トレンドが良好な中で、調整局面を迎えています。買いを検討できるタイミングです。" if final_score >= 1 else "長期トレンドが下降基調のため、積極的な買いはリスクが高いです。" if trends['long'] == "🔴 下降基調" else "明確な方向性が出ていません。様子見が賢明かもしれません。"
+    final_score = min(score, 4) if long_up else 0
+    star_rating = STAR_TABLE[final_score]
+    comment = "複数の買いシグナルが点灯しており、絶好の買い場が近い可能性があります。" if final_score >= 3 else "長期トレンドが良好な中で、調整局面を迎えています。買いを検討できるタイミングです。" if final_score >= 1 else "長期トレンドが下降基調のため、積極的な買いはリスクが高いです。" if long_trend == Trend.DOWN else "明確な方向性が出ていません。様子見が賢明かもしれません。"
     
-    return {"star_rating": star_rating, "score": final_score, "comment": comment, "signals": signals, "trends": trends, "advice": advice}
+    trends = {'long': LONG_TREND_LABELS[long_trend], 'mid': MID_TREND_LABELS[mid_trend], 'short': SHORT_TREND_LABELS[short_trend]}
+
+    # 直近N日のシグナル発生回数 (上でカーネルが判定した直近N日分のビットマスクを数える)
+    recent_counts = {label: int(np.count_nonzero(masks & bit)) for bit, label in RECENT_SIGNAL_LABELS}
+
+    return {"star_rating": star_rating, "score": final_score, "comment": comment, "signals": signals, "trends": trends, "advice": advice, "recent_counts": recent_counts, "signals_mask": signals_mask}
 
 # --- 3. チャート描画関数 ---
-def plot_chart(df, ticker):
+MAX_CHART_POINTS = 1500 # 系列1本あたりの最大描画点数 (超える場合はLTTBで間引く)
+
+def _downsample(df, column):
+    """指定列の形を保つようにLTTBで間引いた行を返す"""
+    return df.iloc[lttb(df[column].to_numpy(dtype=np.float64, copy=False), MAX_CHART_POINTS)]
+
+def _aggregate_ohlc(df):
+    """ローソク足用に、連続するstep本ずつを1本 (最初の始値・最高値・最安値・最後の終値) にまとめる
+
+    点を間引くと間の高値・安値が消えるため、本数が MAX_CHART_POINTS を超える場合は足を束ねて減らす。
+    """
+    n = len(df)
+    step = -(-n // MAX_CHART_POINTS)
+    if step <= 1:
+        return df
+    starts = np.arange(0, n, step)
+    ends = np.append(starts[1:], n) - 1
+    return pd.DataFrame({'Open': df['Open'].to_numpy()[starts], 'High': np.fmax.reduceat(df['High'].to_numpy(), starts),
+                         'Low': np.fmin.reduceat(df['Low'].to_numpy(), starts), 'Close': df['Close'].to_numpy()[ends]}, index=df.index[starts])
+
+@st.cache_resource(ttl=CACHE_TTL, max_entries=32, show_spinner=False, hash_funcs={pd.DataFrame: _frame_key})
+def _build_base_figure(df, ticker):
+    """チャートのFigureを構築する (同じ銘柄・期間の再実行ではキャッシュ済みのFigureを再利用)"""
+    import plotly.graph_objects as go # yfinanceと同様、チャートを描く時に読み込む
+    from plotly.subplots import make_subplots
+    # ローソク足は足を束ね、出来高の棒は急増を残すようLTTBで間引き、指標の線は行ごとに同じ点で間引いてWebGL (Scattergl) で描画
+    candle = _aggregate_ohlc(df)
+    price, volume, vol, rsi, macd = (_downsample(df, c) for c in ('Close', 'Volume', 'Volume_MA20', 'RSI', 'MACD'))
     fig = make_subplots(rows=4, cols=1, shared_xaxes=True, vertical_spacing=0.03, row_heights=[0.6, 0.1, 0.15, 0.15])
-    fig.add_trace(go.Candlestick(x=df.index, open=df['Open'], high=df['High'], low=df['Low'], close=df['Close'], name='ローソク足'), row=1, col=1)
-    fig.add_trace(go.Scatter(x=df.index, y=df['SMA200'], line=dict(color='red', width=2), name='SMA 200'), row=1, col=1)
-    fig.add_trace(go.Scatter(x=df.index, y=df['SMA50'], line=dict(color='green', width=1.5), name='SMA 50'), row=1, col=1)
-    fig.add_trace(go.Scatter(x=df.index, y=df['SMA20'], line=dict(color='orange', width=1, dash='dash'), name='SMA 20'), row=1, col=1)
-    fig.add_trace(go.Scatter(x=df.index, y=df['BB_UPPER'], line=dict(color='rgba(100,100,100,0.5)', width=1)), row=1, col=1)
-    fig.add_trace(go.Scatter(x=df.index, y=df['BB_LOWER'], line=dict(color='rgba(100,100,100,0.5)', width=1), fill='tonexty', fillcolor='rgba(100,100,100,0.1)'), row=1, col=1)
-    fig.add_trace(go.Bar(x=df.index, y=df['Volume'], name='出来高', marker_color='lightblue'), row=2, col=1)
-    fig.add_trace(go.Scatter(x=df.index, y=df['Volume_MA20'], line=dict(color='grey', width=1, dash='dash')), row=2, col=1)
-    fig.add_trace(go.Scatter(x=df.index, y=df['RSI'], name='RSI', line=dict(color='purple')), row=3, col=1)
-    fig.add_shape(type='line', x0=df.index[0], y0=70, x1=df.index[-1], y1=70, line=dict(color='red', dash='dash'), row=3, col=1)
-    fig.add_shape(type='line', x0=df.index[0], y0=30, x1=df.index[-1], y1=30, line=dict(color='green', dash='dash'), row=3, col=1)
-    fig.add_trace(go.Scatter(x=df.index, y=df['MACD'], name='MACD', line=dict(color='blue')), row=4, col=1)
-    fig.add_trace(go.Scatter(x=df.index, y=df['MACD_SIGNAL'], name='Signal', line=dict(color='orange')), row=4, col=1)
+    # トレースは1回のadd_tracesでまとめて追加する (1本ずつ追加するたびの検証・再構築を避ける)
+    traces = [
+        (go.Candlestick(x=candle.index, open=candle['Open'], high=candle['High'], low=candle['Low'], close=candle['Close'], name='ローソク足'), 1),
+        (go.Scattergl(x=price.index, y=price['SMA200'], line=dict(color='red', width=2), name='SMA 200'), 1),
+        (go.Scattergl(x=price.index, y=price['SMA50'], line=dict(color='green', width=1.5), name='SMA 50'), 1),
+        (go.Scattergl(x=price.index, y=price['SMA20'], line=dict(color='orange', width=1, dash='dash'), name='SMA 20'), 1),
+        (go.Scattergl(x=price.index, y=price['BB_UPPER'], line=dict(color='rgba(100,100,100,0.5)', width=1)), 1),
+        (go.Scattergl(x=price.index, y=price['BB_LOWER'], line=dict(color='rgba(100,100,100,0.5)', width=1), fill='tonexty', fillcolor='rgba(100,100,100,0.1)'), 1),
+        (go.Bar(x=volume.index, y=volume['Volume'], name='出来高', marker_color='lightblue'), 2),
+        (go.Scattergl(x=vol.index, y=vol['Volume_MA20'], line=dict(color='grey', width=1, dash='dash')), 2),
+        (go.Scattergl(x=rsi.index, y=rsi['RSI'], name='RSI', line=dict(color='purple')), 3),
+        (go.Scattergl(x=macd.index, y=macd['MACD'], name='MACD', line=dict(color='blue')), 4),
+        (go.Scattergl(x=macd.index, y=macd['MACD_SIGNAL'], name='Signal', line=dict(color='orange')), 4),
+    ]
+    fig.add_traces([t for t, _ in traces], rows=[r for _, r in traces], cols=[1] * len(traces))
+    # RSIの70/30ライン (3段目のx3/y3軸)
+    fig.update_layout(shapes=[dict(type='line', xref='x3', yref='y3', x0=df.index[0], y0=y, x1=df.index[-1], y1=y, line=dict(color=color, dash='dash')) for y, color in ((70, 'red'), (30, 'green'))])
     fig.update_layout(title_text=f'{ticker} テクニカル分析チャート', height=800, xaxis_rangeslider_visible=False, legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1))
     fig.update_yaxes(title_text="価格", row=1, col=1); fig.update_yaxes(title_text="出来高", row=2, col=1); fig.update_yaxes(title_text="RSI", row=3, col=1); fig.update_yaxes(title_text="MACD", row=4, col=1)
-    st.plotly_chart(fig, use_container_width=True)
+    return fig
+
+def plot_chart(df, ticker):
+    st.plotly_chart(_build_base_figure(df, ticker), use_container_width=True)
 
 # --- 4. Streamlitアプリのメイン部分 ---
 st.set_page_config(layout="wide")
@@ -118,30 +281,29 @@ selected_period = st.sidebar.radio("チャート表示期間を選択", options=
 # --- メインコンテンツ ---
 if ticker:
     try:
-        # yfinanceから全期間のデータを取得 (キャッシュ効率化)
-        @st.cache_data
-        def get_stock_data(ticker_symbol):
-            return yf.download(ticker_symbol, period="max")
+        # 取得・指標計算・分析は銘柄が変わった時 (または前回から1時間経過後) だけ行い、
+        # 表示期間の切り替えなどの再実行ではセッションに保持した前回の結果をそのまま使う
+        state = st.session_state.get('analysis')
+        if state is None or state['ticker'] != ticker or time.time() - state['fetched_at'] > CACHE_TTL:
+            # yfinanceから全期間のデータを取得 (キャッシュ効率化)
+            data = get_stock_data(ticker)
+            state = {'ticker': ticker, 'fetched_at': time.time(), 'analyzed_df': None, 'analysis_result': None}
+            if not data.empty:
+                # 分析は全期間データで行い、指標の精度を保証
+                analyzed_df, macd_w_last = calculate_indicators(data)
+                state['analyzed_df'] = analyzed_df
+                state['analysis_result'] = analyze_signals(analyzed_df, macd_w_last)
+            st.session_state.analysis = state
 
-        raw_data = get_stock_data(ticker)
-
-        if raw_data.empty:
+        if state['analyzed_df'] is None:
             st.error("ティッカーが見つからないか、データがありません。")
         else:
-            # データ整形
-            data = pd.DataFrame()
-            data['Open'] = raw_data['Open']; data['High'] = raw_data['High']; data['Low'] = raw_data['Low']; data['Close'] = raw_data['Close']; data['Volume'] = raw_data['Volume']
-            
-            # 分析は全期間データで行い、指標の精度を保証
-            analyzed_df, weekly_df = calculate_indicators(data.copy())
-            
-            # 分析結果を取得
-            analysis_result = analyze_signals(analyzed_df, weekly_df)
-            
+            analyzed_df, analysis_result = state['analyzed_df'], state['analysis_result']
+
             # 表示期間に応じてデータをスライス
             if period_options[selected_period] is not None:
                 start_date = datetime.now() - timedelta(days=period_options[selected_period])
-                display_df = analyzed_df[analyzed_df.index >= start_date]
+                display_df = analyzed_df.loc[start_date:] # 日付順のインデックスなので二分探索で切り出せる
             else:
                 display_df = analyzed_df # 全期間
 
@@ -172,8 +334,12 @@ if ticker:
                         for target in analysis_result['advice']['sell_targets']: st.markdown(f" - {target}")
 
                     with st.expander("🔍 シグナルの詳細な根拠を見る"):
-                        st.write("**買いシグナル:**"); [st.markdown(f"  - {s}") for s in analysis_result['signals']['buy']] if analysis_result['signals']['buy'] else st.markdown("  - なし")
-                        st.write("**売り・注意シグナル:**"); [st.markdown(f"  - {s}") for s in analysis_result['signals']['sell']] if analysis_result['signals']['sell'] else st.markdown("  - なし")
+                        st.write("**買いシグナル:**")
+                        for s in analysis_result['signals']['buy'] or ("なし",): st.markdown(f"  - {s}")
+                        st.write("**売り・注意シグナル:**")
+                        for s in analysis_result['signals']['sell'] or ("なし",): st.markdown(f"  - {s}")
+                        st.write(f"**直近{RECENT_SIGNAL_DAYS}営業日のシグナル発生回数:**")
+                        for label, count in analysis_result['recent_counts'].items(): st.markdown(f"  - {label}: {count}回")
 
                 with col2:
                     plot_chart(display_df, ticker)